@@ -18,8 +18,12 @@ Date: 2025-07-03
 Version: 2.0
 """
 
+import argparse
 import pandas as pd
 import numpy as np
+import os
+import re
+import hashlib
 import warnings
 from datetime import datetime
 import matplotlib.pyplot as plt
@@ -35,63 +39,90 @@ sns.set_palette("husl")
 plt.rcParams['figure.figsize'] = (12, 8)
 plt.rcParams['font.size'] = 10
 
-def get_us_domestic_data():
+# Advance purchase buckets (days to departure), upper edges inclusive
+AP_BUCKET_EDGES = [-np.inf, 7, 14, 21, 30, np.inf]
+AP_BUCKET_LABELS = ['0-7 days', '8-14 days', '15-21 days', '22-30 days', '30+ days']
+
+# Fare family name keywords used in Basic Economy scoring (case-insensitive)
+BASIC_KEYWORDS = ['basic', 'economy', 'main', 'standard', 'saver', 'light', 'essential']
+PREMIUM_KEYWORDS = ['first', 'business', 'premium', 'plus', 'comfort', 'extra', 'flex']
+BASIC_KEYWORDS_RE = re.compile('|'.join(BASIC_KEYWORDS), re.IGNORECASE)
+PREMIUM_KEYWORDS_RE = re.compile('|'.join(PREMIUM_KEYWORDS), re.IGNORECASE)
+
+# Refundable flag spellings (case-insensitive) mapped to 1.0/0.0; flags arrive as
+# booleans, numbers or 'Y'/'Yes'/'N' style strings depending on the source
+REFUNDABLE_FLAGS = {'y': 1.0, 'yes': 1.0, 't': 1.0, 'true': 1.0, '1': 1.0, '1.0': 1.0,
+                    'n': 0.0, 'no': 0.0, 'f': 0.0, 'false': 0.0, '0': 0.0, '0.0': 0.0}
+
+# Local cache for raw query results (see get_us_domestic_data)
+CACHE_DIR = 'cache'
+
+def get_us_domestic_data(use_cache=False):
     """
     Fetch US domestic flight data from Redshift using metadata.airportlocation_extra
     
+    Args:
+        use_cache (bool): Reuse a previously fetched result for the same query from
+            CACHE_DIR instead of querying Redshift, and save fresh results there.
+            The cached file never expires: it is only bypassed when the query text
+            changes, so delete it to pick up new data for an unchanged query
+    
     Returns:
         pd.DataFrame: Raw flight data for US domestic markets
     """
-    print("📊 Fetching US domestic flight data from Redshift...")
-    
-    # Initialize Redshift connection
-    rs.assign_connection("ds")
-    
     # Query for US domestic markets using the airport location table
     query = """
+    WITH us_airports AS (
+        SELECT DISTINCT airportcode
+        FROM metadata.airportlocation_extra
+        WHERE countryname = 'United States'
+    )
     SELECT 
-        carrier,
-        origin,
-        destination,
-        outbound_departure_date,
-        outbound_fare_family,
-        inbound_fare_family,
-        price_inc,
-        price_exc,
-        tax,
-        yqyr,
-        currency,
-        search_class,
-        cabin,
-        outbound_cabins,
-        inbound_cabins,
-        outbound_booking_class,
-        inbound_booking_class,
-        outbound_fare_basis,
-        inbound_fare_basis,
-        refundable,
-        change_fee,
-        los,
-        sales_date,
-        observation_date,
-        customer,
-        outbound_travel_stop_over,
-        inbound_travel_stop_over
-    FROM common_output.common_output_format 
-    WHERE sales_date = 20250629
-    AND origin IN (SELECT airportcode FROM metadata.airportlocation_extra WHERE countryname = 'United States')
-    AND destination IN (SELECT airportcode FROM metadata.airportlocation_extra WHERE countryname = 'United States')
-    AND origin != destination
-    AND carrier IS NOT NULL
-    AND outbound_fare_family IS NOT NULL
-    AND price_inc > 0
+        c.carrier,
+        c.origin,
+        c.destination,
+        c.outbound_departure_date,
+        c.outbound_fare_family,
+        c.inbound_fare_family,
+        c.price_inc,
+        c.price_exc,
+        c.outbound_booking_class,
+        c.refundable,
+        c.change_fee,
+        c.sales_date,
+        c.observation_date
+    FROM common_output.common_output_format c
+    JOIN us_airports o ON c.origin = o.airportcode
+    JOIN us_airports d ON c.destination = d.airportcode
+    WHERE c.sales_date = 20250629
+    AND c.origin != c.destination
+    AND c.carrier IS NOT NULL
+    AND c.outbound_fare_family IS NOT NULL
+    AND c.price_inc > 0
     LIMIT 75000;
     """
     
+    # Cache files are keyed by the query text, so any query change triggers a fresh fetch
+    cache_path = os.path.join(CACHE_DIR, f"us_domestic_{hashlib.sha1(query.encode()).hexdigest()[:12]}.pkl")
+    if use_cache and os.path.exists(cache_path):
+        print(f"📦 Loading cached US domestic flight data from: {cache_path}")
+        df = pd.read_pickle(cache_path)
+        print(f"✅ Loaded {len(df):,} cached records")
+        return df
+    
+    print("📊 Fetching US domestic flight data from Redshift...")
+    
+    # Initialize Redshift connection
+    rs.assign_connection("ds")
+    
     df = rs.rq(query)
     
     if df is not None and len(df) > 0:
         print(f"✅ Fetched {len(df):,} records for US domestic markets")
+        if use_cache:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            df.to_pickle(cache_path)
+            print(f"💾 Cached query results to: {cache_path}")
         return df
     else:
         print("❌ No data returned from query")
@@ -113,12 +144,12 @@ def clean_and_prepare_data(df):
         print("❌ No data to clean")
         return df
     
-    # Create copy to avoid modifying original
-    df = df.copy()
+    # Shallow copy so the column assignments below leave the caller's raw frame untouched
+    df = df.copy(deep=False)
     
-    # Convert date columns
-    df['outbound_departure_date'] = pd.to_datetime(df['outbound_departure_date'], errors='coerce')
-    df['observation_date'] = pd.to_datetime(df['observation_date'], errors='coerce')
+    # Convert date columns; an explicit ISO format keeps parsing off the per-element format inference
+    df['outbound_departure_date'] = pd.to_datetime(df['outbound_departure_date'], format='ISO8601', errors='coerce')
+    df['observation_date'] = pd.to_datetime(df['observation_date'], format='ISO8601', errors='coerce')
     df['sales_date'] = pd.to_datetime(df['sales_date'], format='%Y%m%d', errors='coerce')
     
     # Calculate days to departure (advance purchase window)
@@ -142,6 +173,14 @@ def clean_and_prepare_data(df):
     df['price_exc'] = pd.to_numeric(df['price_exc'], errors='coerce')
     df['change_fee'] = pd.to_numeric(df['change_fee'], errors='coerce')
     
+    # Normalize refundable flag to 1.0/0.0 (NaN only when missing) for refundability rates
+    refundable = df['refundable']
+    refundable_flags = refundable.astype(str).str.strip().str.lower().map(REFUNDABLE_FLAGS)
+    unrecognized = refundable.notna() & refundable_flags.isna()
+    if unrecognized.any():
+        raise ValueError(f"Unrecognized refundable flag values: {sorted(refundable[unrecognized].astype(str).unique())}")
+    df['refundable'] = refundable_flags.where(refundable.notna())
+    
     # Remove invalid data
     initial_count = len(df)
     df = df.dropna(subset=['carrier', 'market', 'primary_fare_family', 'price_inc'])
@@ -150,22 +189,19 @@ def clean_and_prepare_data(df):
     # Only keep records with valid advance purchase data
     df = df.dropna(subset=['days_to_departure'])
     df = df[df['days_to_departure'] >= 0]  # Remove past departures
+    df['days_to_departure'] = df['days_to_departure'].astype('int16')  # no NaNs left; fits easily
+    
+    # Store low-cardinality string columns as categoricals so groupbys work on integer codes
+    for col in ['carrier', 'origin', 'destination', 'market', 'primary_fare_family',
+                'outbound_fare_family', 'inbound_fare_family', 'outbound_booking_class']:
+        df[col] = df[col].astype('category')
     
     # Define advance purchase buckets as specified in requirements
-    def categorize_advance_purchase(days):
-        """Categorize advance purchase days into buckets"""
-        if days <= 7:
-            return '0-7 days'
-        elif days <= 14:
-            return '8-14 days'
-        elif days <= 21:
-            return '15-21 days'
-        elif days <= 30:
-            return '22-30 days'
-        else:
-            return '30+ days'
-    
-    df['advance_purchase_bucket'] = df['days_to_departure'].apply(categorize_advance_purchase)
+    df['advance_purchase_bucket'] = pd.cut(
+        df['days_to_departure'],
+        bins=AP_BUCKET_EDGES,
+        labels=AP_BUCKET_LABELS
+    )
     
     print(f"✅ Cleaned data: {len(df):,} records (removed {initial_count - len(df):,} invalid records)")
     
@@ -229,6 +265,7 @@ def perform_exploratory_data_analysis(df):
     # Advance purchase statistics
     print(f"\n📅 Advance purchase statistics:")
     ap_counts = df['advance_purchase_bucket'].value_counts()
+    ap_counts = ap_counts[ap_counts > 0]  # categorical counts include empty buckets
     for bucket, count in ap_counts.items():
         pct = (count / len(df)) * 100
         print(f"  {bucket}: {count:,} records ({pct:.1f}%)")
@@ -254,38 +291,70 @@ def analyze_advance_purchase_patterns(df):
         return pd.DataFrame()
     
     # Analyze brand availability by advance purchase window
-    ap_analysis = df.groupby(['carrier', 'market', 'advance_purchase_bucket', 'primary_fare_family']).agg({
-        'price_inc': ['count', 'mean', 'min'],
-        'refundable': 'mean',
-        'change_fee': 'mean'
-    }).reset_index()
-    
-    # Flatten column names
-    ap_analysis.columns = ['carrier', 'market', 'advance_purchase_bucket', 'fare_family',
-                          'record_count', 'avg_price', 'min_price', 'refundable_pct', 'avg_change_fee']
+    ap_analysis = df.groupby(['carrier', 'market', 'advance_purchase_bucket', 'primary_fare_family'], observed=True).agg(
+        record_count=('price_inc', 'count'),
+        avg_price=('price_inc', 'mean'),
+        min_price=('price_inc', 'min'),
+        refundable_pct=('refundable', 'mean'),
+        avg_change_fee=('change_fee', 'mean')
+    ).reset_index().rename(columns={'primary_fare_family': 'fare_family'})
     
     print(f"\n📅 Brand availability by advance purchase window:")
     
     # Show top brands by advance purchase window
     for bucket in ['0-7 days', '8-14 days', '15-21 days']:
         print(f"\n{bucket}:")
-        bucket_data = ap_analysis[ap_analysis['advance_purchase_bucket'] == bucket].groupby('fare_family').agg({
+        bucket_data = ap_analysis[ap_analysis['advance_purchase_bucket'] == bucket].groupby('fare_family', observed=True).agg({
             'record_count': 'sum',
             'avg_price': 'mean'
         }).reset_index().sort_values('record_count', ascending=False)
         
-        for _, row in bucket_data.head(8).iterrows():
-            print(f"  {row['fare_family']}: {row['record_count']:,} records, avg ${row['avg_price']:.2f}")
+        top_bucket_brands = bucket_data.head(8)
+        for fare_family, record_count, avg_price in zip(top_bucket_brands['fare_family'].to_numpy(),
+                                                        top_bucket_brands['record_count'].to_numpy(),
+                                                        top_bucket_brands['avg_price'].to_numpy()):
+            print(f"  {fare_family}: {record_count:,} records, avg ${avg_price:.2f}")
     
     return ap_analysis
 
-def analyze_fare_brands_by_airline(df):
+def aggregate_brand_metrics(df):
     """
-    Analyze fare brands for each airline and market combination
+    Aggregate flight data to one row per airline-market-brand combination
+    
+    This is the single pass over the cleaned data shared by the brand analysis
+    and Basic Economy identification steps.
     
     Args:
         df (pd.DataFrame): Cleaned flight data
         
+    Returns:
+        pd.DataFrame: Metrics by carrier, market and fare family
+    """
+    if df.empty:
+        return pd.DataFrame()
+    
+    return df.groupby(['carrier', 'market', 'primary_fare_family'], observed=True).agg(
+        record_count=('price_inc', 'count'),
+        avg_price=('price_inc', 'mean'),
+        min_price=('price_inc', 'min'),
+        max_price=('price_inc', 'max'),
+        price_std=('price_inc', 'std'),
+        refundable_pct=('refundable', 'mean'),
+        avg_change_fee=('change_fee', 'mean'),
+        max_change_fee=('change_fee', 'max'),
+        avg_days_out=('days_to_departure', 'mean'),
+        min_days_out=('days_to_departure', 'min'),
+        max_days_out=('days_to_departure', 'max'),
+        booking_class_variety=('outbound_booking_class', 'nunique')  # number of booking classes
+    ).reset_index().rename(columns={'primary_fare_family': 'fare_family'})
+
+def analyze_fare_brands_by_airline(brand_metrics):
+    """
+    Analyze fare brands for each airline and market combination
+    
+    Args:
+        brand_metrics (pd.DataFrame): Metrics by airline, market and fare family
+        
     Returns:
         pd.DataFrame: Brand analysis by airline and market
     """
@@ -293,27 +362,36 @@ def analyze_fare_brands_by_airline(df):
     print("FARE BRAND ANALYSIS BY AIRLINE")
     print("="*60)
     
-    if df.empty:
+    if brand_metrics.empty:
         print("❌ No data for brand analysis")
         return pd.DataFrame()
     
-    # Group by airline and market to find all brands
-    brand_analysis = df.groupby(['carrier', 'market']).agg({
-        'primary_fare_family': lambda x: sorted(list(set(x))),
-        'price_inc': ['count', 'mean', 'min', 'max'],
-        'days_to_departure': ['mean', 'min', 'max']
-    }).reset_index()
-    
-    # Flatten column names
-    brand_analysis.columns = ['carrier', 'market', 'all_brands', 'record_count', 
-                             'avg_price', 'min_price', 'max_price', 
-                             'avg_days_out', 'min_days_out', 'max_days_out']
-    
-    brand_analysis['num_brands'] = brand_analysis['all_brands'].apply(len)
-    brand_analysis['brand_count_str'] = brand_analysis['all_brands'].apply(lambda x: ', '.join(x))
+    # Roll brand metrics up to airline-market level; means are weighted by record count.
+    # Brands within each group are already sorted, so the joined list is in order.
+    brand_analysis = brand_metrics.assign(
+        price_total=brand_metrics['avg_price'] * brand_metrics['record_count'],
+        days_total=brand_metrics['avg_days_out'] * brand_metrics['record_count']
+    ).groupby(['carrier', 'market'], observed=True).agg(
+        record_count=('record_count', 'sum'),
+        price_total=('price_total', 'sum'),
+        min_price=('min_price', 'min'),
+        max_price=('max_price', 'max'),
+        days_total=('days_total', 'sum'),
+        min_days_out=('min_days_out', 'min'),
+        max_days_out=('max_days_out', 'max'),
+        num_brands=('fare_family', 'size'),
+        brand_count_str=('fare_family', ', '.join)
+    ).reset_index()
+    
+    brand_analysis['avg_price'] = brand_analysis['price_total'] / brand_analysis['record_count']
+    brand_analysis['avg_days_out'] = brand_analysis['days_total'] / brand_analysis['record_count']
+    brand_analysis = brand_analysis[['carrier', 'market', 'record_count',
+                                     'avg_price', 'min_price', 'max_price',
+                                     'avg_days_out', 'min_days_out', 'max_days_out',
+                                     'num_brands', 'brand_count_str']]
     
     print(f"\n📊 Brand diversity by airline:")
-    airline_brand_summary = brand_analysis.groupby('carrier').agg({
+    airline_brand_summary = brand_analysis.groupby('carrier', observed=True).agg({
         'num_brands': ['mean', 'min', 'max'],
         'market': 'count'
     }).round(2)
@@ -323,13 +401,12 @@ def analyze_fare_brands_by_airline(df):
     
     return brand_analysis
 
-def identify_basic_economy_candidates(df, brand_analysis):
+def identify_basic_economy_candidates(brand_metrics):
     """
     Identify Basic Economy candidates using multiple criteria
     
     Args:
-        df (pd.DataFrame): Cleaned flight data
-        brand_analysis (pd.DataFrame): Brand analysis results
+        brand_metrics (pd.DataFrame): Metrics by airline, market and fare family
         
     Returns:
         tuple: (basic_economy_candidates, brand_metrics)
@@ -338,92 +415,57 @@ def identify_basic_economy_candidates(df, brand_analysis):
     print("BASIC ECONOMY IDENTIFICATION")
     print("="*60)
     
-    if df.empty or brand_analysis.empty:
+    if brand_metrics.empty:
         print("❌ No data for Basic Economy identification")
         return pd.DataFrame(), pd.DataFrame()
     
-    # Create comprehensive analysis for each airline-market-brand combination
-    brand_metrics = df.groupby(['carrier', 'market', 'primary_fare_family']).agg({
-        'price_inc': ['count', 'mean', 'min', 'max', 'std'],
-        'refundable': 'mean',
-        'change_fee': ['mean', 'max'],
-        'days_to_departure': 'mean',
-        'outbound_booking_class': lambda x: len(set(x))  # number of booking classes
-    }).reset_index()
-    
-    # Flatten column names
-    brand_metrics.columns = ['carrier', 'market', 'fare_family', 'record_count', 
-                           'avg_price', 'min_price', 'max_price', 'price_std',
-                           'refundable_pct', 'avg_change_fee', 'max_change_fee',
-                           'avg_days_out', 'booking_class_variety']
-    
-    # Calculate price rank within each airline-market combination
-    brand_metrics['price_rank'] = brand_metrics.groupby(['carrier', 'market'])['avg_price'].rank(method='min')
-    
-    # Basic Economy scoring criteria
-    def calculate_basic_economy_score(row):
-        """
-        Calculate Basic Economy score based on multiple factors:
-        - Price rank (40% weight)
-        - Refundability (20% weight) 
-        - Change fees (20% weight)
-        - Brand name analysis (20% weight)
-        """
-        score = 0
-        
-        # Price criteria (40% weight)
-        if row['price_rank'] == 1:  # Cheapest average price
-            score += 40
-        elif row['price_rank'] == 2:
-            score += 30
-        elif row['price_rank'] <= 3:
-            score += 20
-        
-        # Refundability (20% weight)
-        if pd.notna(row['refundable_pct']):
-            if row['refundable_pct'] < 0.1:  # Less than 10% refundable
-                score += 20
-            elif row['refundable_pct'] < 0.3:
-                score += 10
-        
-        # Change fee criteria (20% weight)
-        if pd.notna(row['avg_change_fee']):
-            if row['avg_change_fee'] > 100:  # High change fees
-                score += 20
-            elif row['avg_change_fee'] > 50:
-                score += 10
-        
-        # Brand name analysis (20% weight)
-        fare_family_lower = str(row['fare_family']).lower()
-        basic_keywords = ['basic', 'economy', 'main', 'standard', 'saver', 'light', 'essential']
-        premium_keywords = ['first', 'business', 'premium', 'plus', 'comfort', 'extra', 'flex']
-        
-        if any(keyword in fare_family_lower for keyword in basic_keywords):
-            score += 15
-        if any(keyword in fare_family_lower for keyword in premium_keywords):
-            score -= 15
-        
-        return score
+    # Work on our own frame so the shared metrics are left untouched
+    brand_metrics = brand_metrics.copy()
+    
+    # Calculate price rank within each airline-market combination; ranks come back
+    # aligned to the rows, so the groups need no key sort
+    brand_metrics['price_rank'] = brand_metrics.groupby(
+        ['carrier', 'market'], observed=True, sort=False
+    )['avg_price'].rank(method='min')
     
-    # Apply scoring function
-    brand_metrics['basic_economy_score'] = brand_metrics.apply(calculate_basic_economy_score, axis=1)
+    # Basic Economy scoring criteria (vectorized over all brand rows):
+    # - Price rank (40% weight)
+    # - Refundability (20% weight)
+    # - Change fees (20% weight)
+    # - Brand name analysis (20% weight)
+    price_rank = brand_metrics['price_rank'].to_numpy()
+    refundable_pct = brand_metrics['refundable_pct'].to_numpy(dtype=float)
+    avg_change_fee = np.nan_to_num(brand_metrics['avg_change_fee'].to_numpy(dtype=float), nan=0.0)
+    
+    # Price criteria (40% weight); NaN comparisons are False so missing data scores 0
+    price_score = np.select([price_rank == 1, price_rank == 2, price_rank <= 3], [40, 30, 20], default=0)
+    
+    # Refundability (20% weight)
+    refund_score = np.select([refundable_pct < 0.1, refundable_pct < 0.3], [20, 10], default=0)
+    
+    # Change fee criteria (20% weight): >50 -> 10 points, >100 -> 20 points; missing fees score 0
+    change_fee_score = np.array([0, 10, 20])[np.searchsorted([50, 100], avg_change_fee, side='left')]
+    
+    # Brand name analysis (20% weight); keywords are matched once per distinct
+    # fare family and broadcast back to the rows through the factorized codes
+    codes, fare_families = pd.factorize(brand_metrics['fare_family'])
+    fare_families = pd.Series(fare_families.astype(str))
+    basic_match = fare_families.str.contains(BASIC_KEYWORDS_RE).to_numpy()[codes]
+    premium_match = fare_families.str.contains(PREMIUM_KEYWORDS_RE).to_numpy()[codes]
+    brand_score = np.where(basic_match, 15, 0) - np.where(premium_match, 15, 0)
+    
+    brand_metrics['basic_economy_score'] = price_score + refund_score + change_fee_score + brand_score
     
     # Identify Basic Economy for each airline-market combination
     basic_economy_candidates = brand_metrics.loc[
-        brand_metrics.groupby(['carrier', 'market'])['basic_economy_score'].idxmax()
+        brand_metrics.groupby(['carrier', 'market'], observed=True)['basic_economy_score'].idxmax()
     ].copy()
     
-    # Add confidence level
-    def assign_confidence(score):
-        """Assign confidence level based on score"""
-        if score >= 70:
-            return 'High'
-        elif score >= 50:
-            return 'Medium'
-        else:
-            return 'Low'
-    
-    basic_economy_candidates['confidence'] = basic_economy_candidates['basic_economy_score'].apply(assign_confidence)
+    # Add confidence level: High >= 70, Medium >= 50, Low otherwise
+    score = basic_economy_candidates['basic_economy_score'].to_numpy()
+    basic_economy_candidates['confidence'] = np.select(
+        [score >= 70, score >= 50], ['High', 'Medium'], default='Low'
+    )
     
     print(f"\n🎯 Basic Economy Identification Results:")
     print(f"Total airline-market combinations analyzed: {len(basic_economy_candidates):,}")
@@ -434,17 +476,19 @@ def identify_basic_economy_candidates(df, brand_analysis):
     
     # Show examples by airline
     print(f"\n✈️ Basic Economy candidates by airline:")
+    # Most common high-confidence brand per airline from one grouped count; the stable
+    # sort keeps ties in fare family order, matching Series.mode()
+    high_conf = basic_economy_candidates[basic_economy_candidates['confidence'] == 'High']
+    brand_counts = high_conf.groupby(['carrier', 'fare_family'], observed=True).size().reset_index(name='markets')
+    top_brands = brand_counts.sort_values('markets', ascending=False, kind='stable').drop_duplicates('carrier').set_index('carrier')
+    high_conf_markets = brand_counts.groupby('carrier', observed=True)['markets'].sum()
     for carrier in basic_economy_candidates['carrier'].unique()[:8]:
-        carrier_data = basic_economy_candidates[basic_economy_candidates['carrier'] == carrier]
-        high_conf = carrier_data[carrier_data['confidence'] == 'High']
-        if len(high_conf) > 0:
-            most_common_brand = high_conf['fare_family'].mode()
-            if len(most_common_brand) > 0:
-                print(f"  {carrier}: {most_common_brand[0]} (in {len(high_conf)} markets)")
+        if carrier in top_brands.index:
+            print(f"  {carrier}: {top_brands.at[carrier, 'fare_family']} (in {high_conf_markets[carrier]} markets)")
     
     return basic_economy_candidates, brand_metrics
 
-def create_visualizations(df, ap_analysis, basic_economy_candidates):
+def create_visualizations(df, ap_analysis, basic_economy_candidates, brand_analysis, run_timestamp=None):
     """
     Create comprehensive visualizations for the analysis
     
@@ -452,6 +496,8 @@ def create_visualizations(df, ap_analysis, basic_economy_candidates):
         df (pd.DataFrame): Cleaned flight data
         ap_analysis (pd.DataFrame): Advance purchase analysis
         basic_economy_candidates (pd.DataFrame): Basic Economy identification results
+        brand_analysis (pd.DataFrame): Brand analysis by airline and market
+        run_timestamp (str): Timestamp shared by the run's output files; defaults to now
     """
     print("\n" + "="*60)
     print("CREATING VISUALIZATIONS")
@@ -461,23 +507,46 @@ def create_visualizations(df, ap_analysis, basic_economy_candidates):
         print("❌ No data for visualizations")
         return
     
+    run_timestamp = run_timestamp or datetime.now().strftime('%Y%m%d_%H%M%S')
+    
     # Create figure with subplots
     fig, axes = plt.subplots(2, 3, figsize=(20, 12))
     fig.suptitle('Fare Brand Analysis and Basic Economy Detection - US Domestic Markets', 
                  fontsize=16, fontweight='bold')
     
+    # Record counts per airline, shared by the first two panels
+    airline_counts = df['carrier'].value_counts()
+    
     # 1. Airline distribution
-    airline_counts = df['carrier'].value_counts().head(10)
-    axes[0, 0].bar(airline_counts.index, airline_counts.values, color='skyblue')
+    top10_airlines = airline_counts.head(10)
+    axes[0, 0].bar(top10_airlines.index, top10_airlines.values, color='skyblue')
     axes[0, 0].set_title('Top Airlines by Record Count')
     axes[0, 0].set_xlabel('Airline')
     axes[0, 0].set_ylabel('Number of Records')
     axes[0, 0].tick_params(axis='x', rotation=45)
     
     # 2. Price distribution by airline
-    top_airlines = df['carrier'].value_counts().head(6).index
+    top_airlines = airline_counts.head(6).index
     price_data = df[df['carrier'].isin(top_airlines)]
-    price_data.boxplot(column='price_inc', by='carrier', ax=axes[0, 1])
+    
+    # Box statistics per carrier in a few grouped passes; whiskers reach the most
+    # extreme prices within 1.5 IQR of the box, matching the default boxplot rule
+    quartiles = price_data.groupby('carrier', observed=True)['price_inc'].quantile([0.25, 0.5, 0.75]).unstack()
+    iqr = quartiles[0.75] - quartiles[0.25]
+    row_carriers = price_data['carrier'].astype(object)
+    low_fence = (quartiles[0.25] - 1.5 * iqr).reindex(row_carriers).to_numpy()
+    high_fence = (quartiles[0.75] + 1.5 * iqr).reindex(row_carriers).to_numpy()
+    prices = price_data['price_inc'].to_numpy()
+    whiskers = price_data[(prices >= low_fence) & (prices <= high_fence)].groupby(
+        'carrier', observed=True
+    )['price_inc'].agg(['min', 'max'])
+    box_stats = [
+        {'label': carrier, 'q1': quartiles.loc[carrier, 0.25], 'med': quartiles.loc[carrier, 0.5],
+         'q3': quartiles.loc[carrier, 0.75],
+         'whislo': whiskers.loc[carrier, 'min'], 'whishi': whiskers.loc[carrier, 'max']}
+        for carrier in quartiles.index
+    ]
+    axes[0, 1].bxp(box_stats, showfliers=False)
     axes[0, 1].set_title('Price Distribution by Airline')
     axes[0, 1].set_xlabel('Airline')
     axes[0, 1].set_ylabel('Price (USD)')
@@ -485,17 +554,18 @@ def create_visualizations(df, ap_analysis, basic_economy_candidates):
     
     # 3. Advance purchase distribution
     ap_counts = df['advance_purchase_bucket'].value_counts()
+    ap_counts = ap_counts[ap_counts > 0]  # categorical counts include empty buckets
     axes[0, 2].pie(ap_counts.values, labels=ap_counts.index, autopct='%1.1f%%', startangle=90)
     axes[0, 2].set_title('Distribution by Advance Purchase Window')
     
     # 4. Brand availability by advance purchase window
     if not ap_analysis.empty:
-        ap_summary = ap_analysis.groupby(['advance_purchase_bucket', 'fare_family']).agg({
+        ap_summary = ap_analysis.groupby(['advance_purchase_bucket', 'fare_family'], observed=True).agg({
             'record_count': 'sum'
         }).reset_index()
         
         # Get top 5 brands for visualization
-        top_brands = ap_summary.groupby('fare_family')['record_count'].sum().nlargest(5).index
+        top_brands = ap_summary.groupby('fare_family', observed=True)['record_count'].sum().nlargest(5).index
         
         ap_pivot = ap_summary[ap_summary['fare_family'].isin(top_brands)].pivot(
             index='advance_purchase_bucket', columns='fare_family', values='record_count'
@@ -525,7 +595,7 @@ def create_visualizations(df, ap_analysis, basic_economy_candidates):
     
     # 6. Basic Economy brands by airline
     if not basic_economy_candidates.empty:
-        be_by_airline = basic_economy_candidates[basic_economy_candidates['confidence'] == 'High'].groupby('carrier')['fare_family'].agg(lambda x: x.mode()[0] if len(x.mode()) > 0 else 'Unknown')
+        be_by_airline = basic_economy_candidates[basic_economy_candidates['confidence'] == 'High'].groupby('carrier', observed=True)['fare_family'].agg(lambda x: x.mode()[0] if len(x.mode()) > 0 else 'Unknown')
         axes[1, 2].bar(range(len(be_by_airline)), be_by_airline.values, color='lightcoral')
         axes[1, 2].set_title('High-Confidence Basic Economy Brands by Airline')
         axes[1, 2].set_xlabel('Airline')
@@ -536,14 +606,15 @@ def create_visualizations(df, ap_analysis, basic_economy_candidates):
     plt.tight_layout()
     
     # Save the visualization
-    viz_filename = f"output/fare_brand_analysis_visualizations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
+    viz_filename = f"output/fare_brand_analysis_visualizations_{run_timestamp}.png"
     plt.savefig(viz_filename, dpi=300, bbox_inches='tight')
+    plt.close(fig)
     print(f"💾 Saved visualizations to: {viz_filename}")
     
     # Create additional summary statistics visualization
-    create_summary_statistics_visualization(df, ap_analysis, basic_economy_candidates)
+    create_summary_statistics_visualization(df, ap_analysis, basic_economy_candidates, brand_analysis, run_timestamp)
 
-def create_summary_statistics_visualization(df, ap_analysis, basic_economy_candidates):
+def create_summary_statistics_visualization(df, ap_analysis, basic_economy_candidates, brand_analysis, run_timestamp=None):
     """
     Create additional summary statistics visualization
     
@@ -551,14 +622,15 @@ def create_summary_statistics_visualization(df, ap_analysis, basic_economy_candi
         df (pd.DataFrame): Cleaned flight data
         ap_analysis (pd.DataFrame): Advance purchase analysis
         basic_economy_candidates (pd.DataFrame): Basic Economy identification results
+        brand_analysis (pd.DataFrame): Brand analysis by airline and market
+        run_timestamp (str): Timestamp shared by the run's output files; defaults to now
     """
     fig, axes = plt.subplots(2, 2, figsize=(16, 12))
     fig.suptitle('Summary Statistics and Brand Distribution', fontsize=16, fontweight='bold')
     
-    # 1. Market complexity by airline
-    if not df.empty:
-        market_complexity = df.groupby(['carrier', 'market'])['primary_fare_family'].nunique().reset_index()
-        avg_complexity = market_complexity.groupby('carrier')['primary_fare_family'].mean().sort_values(ascending=False)
+    # 1. Market complexity by airline (brands per market are already counted in brand_analysis)
+    if not brand_analysis.empty:
+        avg_complexity = brand_analysis.groupby('carrier', observed=True)['num_brands'].mean().sort_values(ascending=False)
         
         axes[0, 0].bar(avg_complexity.index, avg_complexity.values, color='steelblue')
         axes[0, 0].set_title('Average Brands per Market by Airline')
@@ -568,7 +640,7 @@ def create_summary_statistics_visualization(df, ap_analysis, basic_economy_candi
     
     # 2. Price vs Advance Purchase
     if not df.empty:
-        price_ap = df.groupby('advance_purchase_bucket')['price_inc'].mean()
+        price_ap = df.groupby('advance_purchase_bucket', observed=True)['price_inc'].mean()
         axes[0, 1].bar(price_ap.index, price_ap.values, color='gold')
         axes[0, 1].set_title('Average Price by Advance Purchase Window')
         axes[0, 1].set_xlabel('Advance Purchase Window')
@@ -577,7 +649,7 @@ def create_summary_statistics_visualization(df, ap_analysis, basic_economy_candi
     
     # 3. Refundability by brand type
     if not df.empty:
-        refund_by_brand = df.groupby('primary_fare_family')['refundable'].mean().sort_values(ascending=False).head(10)
+        refund_by_brand = df.groupby('primary_fare_family', observed=True)['refundable'].mean().sort_values(ascending=False).head(10)
         axes[1, 0].barh(refund_by_brand.index, refund_by_brand.values, color='lightgreen')
         axes[1, 0].set_title('Refundability Rate by Fare Family (Top 10)')
         axes[1, 0].set_xlabel('Refundability Rate')
@@ -596,17 +668,20 @@ def create_summary_statistics_visualization(df, ap_analysis, basic_economy_candi
     plt.tight_layout()
     
     # Save the summary visualization
-    summary_viz_filename = f"output/summary_statistics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
+    run_timestamp = run_timestamp or datetime.now().strftime('%Y%m%d_%H%M%S')
+    summary_viz_filename = f"output/summary_statistics_{run_timestamp}.png"
     plt.savefig(summary_viz_filename, dpi=300, bbox_inches='tight')
+    plt.close(fig)
     print(f"💾 Saved summary statistics to: {summary_viz_filename}")
 
-def create_deliverable_table(basic_economy_candidates, brand_analysis):
+def create_deliverable_table(basic_economy_candidates, brand_analysis, run_timestamp=None):
     """
     Create the final deliverable table
     
     Args:
         basic_economy_candidates (pd.DataFrame): Basic Economy identification results
         brand_analysis (pd.DataFrame): Brand analysis results
+        run_timestamp (str): Timestamp shared by the run's output files; defaults to now
         
     Returns:
         pd.DataFrame: Final deliverable table
@@ -619,17 +694,23 @@ def create_deliverable_table(basic_economy_candidates, brand_analysis):
         print("❌ No data for deliverable table")
         return pd.DataFrame()
     
-    # Merge brand analysis with basic economy identification
-    deliverable = brand_analysis.merge(
-        basic_economy_candidates[['carrier', 'market', 'fare_family', 'basic_economy_score', 'confidence']],
-        left_on=['carrier', 'market'],
-        right_on=['carrier', 'market'],
-        how='left'
-    )
+    # Join brand analysis with basic economy identification; candidates are unique
+    # per airline-market, so they are looked up through their index (validate fails
+    # fast instead of duplicating rows if that ever stops holding)
+    be_by_market = basic_economy_candidates.set_index(['carrier', 'market'])[
+        ['fare_family', 'basic_economy_score', 'confidence']
+    ]
+    deliverable = brand_analysis.join(be_by_market, on=['carrier', 'market'], how='left', validate='many_to_one')
     
     # Rename columns to match requirements
-    deliverable_final = deliverable[['carrier', 'market', 'brand_count_str', 'fare_family', 'confidence', 'basic_economy_score']].copy()
-    deliverable_final.columns = ['Airline', 'Market', 'All_Detected_Brands', 'Identified_Basic_Economy_Brand', 'Confidence_Level', 'BE_Score']
+    deliverable_final = deliverable[['carrier', 'market', 'brand_count_str', 'fare_family', 'confidence', 'basic_economy_score']].rename(columns={
+        'carrier': 'Airline',
+        'market': 'Market',
+        'brand_count_str': 'All_Detected_Brands',
+        'fare_family': 'Identified_Basic_Economy_Brand',
+        'confidence': 'Confidence_Level',
+        'basic_economy_score': 'BE_Score'
+    })
     
     # Sort by airline and market
     deliverable_final = deliverable_final.sort_values(['Airline', 'Market'])
@@ -639,16 +720,21 @@ def create_deliverable_table(basic_economy_candidates, brand_analysis):
     print(deliverable_final.head(10).to_string(index=False))
     
     # Save to CSV
-    output_filename = f"output/basic_economy_analysis_enhanced_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    run_timestamp = run_timestamp or datetime.now().strftime('%Y%m%d_%H%M%S')
+    output_filename = f"output/basic_economy_analysis_enhanced_{run_timestamp}.csv"
     deliverable_final.to_csv(output_filename, index=False)
     print(f"\n💾 Saved deliverable table to: {output_filename}")
     
     return deliverable_final
 
-def main():
+def main(use_cache=False, verbose=False):
     """
     Main execution function for the fare brand analysis pipeline
     
+    Args:
+        use_cache (bool): Reuse cached Redshift results when available
+        verbose (bool): Print the exploratory data analysis report
+    
     Returns:
         tuple: (df_analyzed, deliverable_final, basic_economy_candidates, ap_analysis)
     """
@@ -666,9 +752,12 @@ def main():
     
     print("\n🚀 Starting Enhanced Fare Brand Analysis and Basic Economy Detection...")
     
+    # One timestamp for every file this run writes, so its outputs are easy to match up
+    run_timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    
     try:
         # Step 1: Fetch data
-        df = get_us_domestic_data()
+        df = get_us_domestic_data(use_cache=use_cache)
         
         if df.empty:
             print("❌ No data to analyze")
@@ -681,25 +770,26 @@ def main():
             print("❌ No data remaining after cleaning")
             return None, None, None, None
         
-        # Step 3: Exploratory Data Analysis
-        df_analyzed = perform_exploratory_data_analysis(df_clean)
+        # Step 3: Exploratory Data Analysis (report only, nothing downstream uses it)
+        if verbose:
+            perform_exploratory_data_analysis(df_clean)
+        df_analyzed = df_clean
         
         # Step 4: Analyze advance purchase patterns
         ap_analysis = analyze_advance_purchase_patterns(df_analyzed)
         
         # Step 5: Analyze fare brands by airline
-        brand_analysis = analyze_fare_brands_by_airline(df_analyzed)
+        brand_metrics = aggregate_brand_metrics(df_analyzed)
+        brand_analysis = analyze_fare_brands_by_airline(brand_metrics)
         
         # Step 6: Identify Basic Economy candidates
-        basic_economy_candidates, brand_metrics = identify_basic_economy_candidates(
-            df_analyzed, brand_analysis
-        )
+        basic_economy_candidates, brand_metrics = identify_basic_economy_candidates(brand_metrics)
         
         # Step 7: Create visualizations
-        create_visualizations(df_analyzed, ap_analysis, basic_economy_candidates)
+        create_visualizations(df_analyzed, ap_analysis, basic_economy_candidates, brand_analysis, run_timestamp)
         
         # Step 8: Create deliverable table
-        deliverable_final = create_deliverable_table(basic_economy_candidates, brand_analysis)
+        deliverable_final = create_deliverable_table(basic_economy_candidates, brand_analysis, run_timestamp)
         
         print(f"\n✅ Enhanced analysis completed successfully!")
         print(f"📄 Check the generated CSV file for detailed results.")
@@ -714,4 +804,8 @@ def main():
         return None, None, None, None
 
 if __name__ == "__main__":
-    df, deliverable, basic_economy, ap_analysis = main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fare brand analysis and Basic Economy detection for US domestic markets")
+    parser.add_argument("--verbose", action="store_true", help="print the exploratory data analysis report")
+    parser.add_argument("--use-cache", action="store_true", help=f"reuse the raw query result cached under {CACHE_DIR}/")
+    args = parser.parse_args()
+    df, deliverable, basic_economy, ap_analysis = main(use_cache=args.use_cache, verbose=args.verbose)
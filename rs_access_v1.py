@@ -6,14 +6,20 @@
 # usage : assign_connection("Analytics")
 # usage : assign_connection("Core")
 
+import csv
+import functools
 import json
 import logging
+import os
 import sys
+import uuid
 
 import boto3
 import pandas as pd
 import psycopg2 as pg
 from botocore.exceptions import ClientError
+from psycopg2 import sql
+from psycopg2.extras import execute_values
 
 print("rs_access_admin.py is being imported !!")
 logger = logging.getLogger(__name__)
@@ -48,9 +54,20 @@ class RedshiftAccess:
             print("Database name not recognized")
             raise Exception("Database name not recognized")
 
+        self.database_name = database_name
         self.secret_name = secret_name
         self.region_name = "us-east-1"
-        self.dbparam = get_secret_str(secret_name, self.region_name)
+        try:
+            con = self._connect()
+        except pg.OperationalError as error:
+            # The memoized secret may be stale (e.g. a rotated password): fetch it again and retry once
+            print(f"Connection failed, refreshing secret and retrying: {error}")
+            get_secret_str.cache_clear()
+            con = self._connect()
+        self.connection = con
+
+    def _connect(self):
+        self.dbparam = get_secret_str(self.secret_name, self.region_name)
         _db_secret = self.dbparam
         db_secret = _db_secret[0]
 
@@ -58,19 +75,19 @@ class RedshiftAccess:
         print(
             f"Host: {db_secret['host']}, DB: {db_secret['dbname']}, User: {db_secret['username']}, Port: {db_secret['port']}"
         )
-        con = pg.connect(
+        return pg.connect(
             host=db_secret["host"],
             dbname=db_secret["dbname"],
             port=db_secret["port"],
             user=db_secret["username"],
             password=db_secret["password"],
         )
-        self.connection = con
 
     def close_connection(self):
         self.connection.close()
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)  # the caller identity doesn't change within a session
     def get_rs_account_info():
         sts_client = boto3.client("sts", region_name="us-east-1")
         try:
@@ -94,6 +111,7 @@ class RedshiftAccess:
             raise e
 
 
+@functools.lru_cache(maxsize=16)  # one Secrets Manager round trip per secret per session
 def get_secret_str(secret_name, region_name):
     print("Getting secret..")
     client = boto3.client("secretsmanager", region_name=region_name)
@@ -110,7 +128,31 @@ def get_secret_str(secret_name, region_name):
         raise e
 
 
+def _reusable(instance, database_name):
+    # True when instance holds an open connection to database_name. rq never
+    # commits, so its read transaction (or a failed one) is rolled back first:
+    # reusing it as-is would keep reading the first query's snapshot and hold the
+    # tables' locks for the rest of the session. The helpers commit every write,
+    # so only reads are discarded here.
+    # closed only reflects closes seen by the client, so a quick round trip also
+    # catches sessions the server has dropped (e.g. an idle-session timeout).
+    if instance is None or instance.database_name != database_name or instance.connection.closed:
+        return False
+    connection = instance.connection
+    try:
+        if connection.get_transaction_status() != pg.extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        connection.rollback()  # don't leave the ping's transaction open
+    except pg.Error:
+        return False
+    return True
+
+
 def assign_connection(database_name):
+    if _reusable(RedshiftAccess._instance, database_name):
+        return  # Open connection to the same database, now idle; keep using it
     RedshiftAccess._instance = None  # Force reset the connection
     RedshiftAccess(database_name)  # Reinitialize connection
 
@@ -122,32 +164,134 @@ def close_connection():
         RedshiftAccess._instance = None  # Ensure a fresh connection is made later
 
 
+def _rollback():
+    # Clears a failed transaction so later statements can run; skipped when the
+    # connection itself has dropped (assign_connection will rebuild it)
+    connection = RedshiftAccess._instance.connection
+    if not connection.closed:
+        connection.rollback()
+
+
 def rq(qq):
     df = None
     colnames = None
     try:
-        cursor = RedshiftAccess._instance.connection.cursor()
+        with RedshiftAccess._instance.connection.cursor() as cursor:  # closed on exit
+            cursor.execute(qq)  # execute our Query
+            colnames = [desc[0] for desc in cursor.description]  # get headers
+            records = cursor.fetchall()  # retrieve the records from the database
+            df = pd.DataFrame(records, columns=colnames)  # create pd df
+    except pg.DatabaseError as error:
+        print(error)
+        _rollback()  # leave the connection usable
+    return df
+
+
+def _fetch_chunks(qq, chunksize):
+    # Runs qq on a server-side (named) cursor and yields (colnames, records) per
+    # fetchmany chunk; the first chunk is always yielded, empty for an empty result,
+    # so callers get the headers either way. Errors are re-raised after the rollback.
+    cursor = RedshiftAccess._instance.connection.cursor(name=f"rq_iter_{uuid.uuid4().hex}")
+    cursor.itersize = chunksize
+    try:
         cursor.execute(qq)  # execute our Query
+        records = cursor.fetchmany(chunksize)
         colnames = [desc[0] for desc in cursor.description]  # get headers
-        records = cursor.fetchall()  # retrieve the records from the database
-        df = pd.DataFrame(records, columns=colnames)  # create pd df
+        yield colnames, records
+        while records:
+            records = cursor.fetchmany(chunksize)
+            if records:
+                yield colnames, records
     except pg.DatabaseError as error:
         print(error)
-    cursor.close()
-    return df
+        cursor.close()  # before the rollback, which invalidates the named cursor
+        _rollback()  # leave the connection usable
+        raise
+    finally:
+        cursor.close()
+
+
+def rq_iter(qq, chunksize=200000):
+    # Streams the result through a server-side (named) cursor, yielding one
+    # DataFrame per chunk so large results never sit in memory all at once.
+    # The cursor lives in the connection's open transaction: don't run other
+    # statements (rq, action_rs, insert_df, ...) on the connection until the
+    # iteration is done, as any commit or rollback invalidates the cursor.
+    # Each call gets its own cursor name so several iterators can be open at once.
+    # Unlike rq, a failed query is re-raised (after the rollback): chunks may
+    # already have been consumed, so the caller must not mistake a partial
+    # result for a complete one.
+    for colnames, records in _fetch_chunks(qq, chunksize):
+        if records:
+            yield pd.DataFrame(records, columns=colnames)
+
+
+def rq_to_csv(qq, path, chunksize=200000):
+    # Writes the result to a CSV file chunk by chunk, so memory use stays at one
+    # chunk whatever the result size. Rows are written as fetched rather than
+    # through per-chunk DataFrames, so a column is formatted the same way in
+    # every chunk (an int column with a NULL stays 5, not 5.0). The header is
+    # always written, even for an empty result, and the file is built under a
+    # temporary name and only moved to path once the whole result is in, so a
+    # failed query never leaves a truncated CSV behind. Returns the number of
+    # rows written; as with rq_iter, errors are re-raised and no other statements
+    # should run on the connection until it returns.
+    tmp_path = f"{path}.tmp"
+    rows = 0
+    try:
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            for i, (colnames, records) in enumerate(_fetch_chunks(qq, chunksize)):
+                if i == 0:
+                    writer.writerow(colnames)  # header, from the first (possibly empty) chunk
+                writer.writerows(records)
+                rows += len(records)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)  # partial output from a failed run
+    return rows
 
 
 def action_rs(qq):
     t = "N/a"
     try:
-        cursor = RedshiftAccess._instance.connection.cursor()
-        cursor.execute(qq)  # execute our Query
+        with RedshiftAccess._instance.connection.cursor() as cursor:  # closed on exit
+            cursor.execute(qq)  # execute our Query
         RedshiftAccess._instance.connection.commit()
         t = "action_rs action is complete"
     except pg.DatabaseError as error:
         print(error)
+        _rollback()  # leave the connection usable
+        t = "there was an error: " + str(error)
+    return t
+
+
+def insert_df(df, table, page_size=1000):
+    # Redshift doesn't accept COPY ... FROM STDIN, so rows go out as multi-row
+    # INSERT statements, page_size rows per round trip instead of one per row.
+    # table may be schema-qualified ("schema.table"); the table and column names
+    # are quoted as identifiers, so mixed-case or reserved names work as given
+    t = "N/a"
+    query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+        sql.Identifier(*table.split(".")),
+        sql.SQL(", ").join(sql.Identifier(column) for column in df.columns),
+    )
+    rows = df.astype(object).where(df.notna(), None)  # plain Python values, NULL for NaN
+    try:
+        with RedshiftAccess._instance.connection.cursor() as cursor:  # closed on exit
+            execute_values(
+                cursor,
+                query,
+                rows.itertuples(index=False, name=None),
+                page_size=page_size,
+            )
+        RedshiftAccess._instance.connection.commit()
+        t = "insert_df action is complete"
+    except pg.DatabaseError as error:
+        print(error)
+        _rollback()  # leave the connection usable
         t = "there was an error: " + str(error)
-    cursor.close()
     return t
 
 
@@ -155,11 +299,12 @@ def alter_rs(qq):
     t = "N/a"
     try:
         # con.set_isolation_level('ISOLATION_LEVEL_AUTOCOMMIT')
-        cursor = RedshiftAccess._instance.connection.cursor()
-        cursor.execute(qq)  # execute our Query
+        with RedshiftAccess._instance.connection.cursor() as cursor:  # closed on exit
+            cursor.execute(qq)  # execute our Query
         RedshiftAccess._instance.connection.commit()
         t = "alter_rs action is complete"
     except pg.DatabaseError as error:
         print(error)
+        _rollback()  # leave the connection usable
         t = "there was an error: " + str(error)
     return t